@@ -21,10 +21,16 @@
 - IMAGE_FOLDER도 올리려는 이미지 경로에 맞게 수정
 """
 
-import os, json, subprocess, signal, requests
+import os, io, mmap, subprocess, signal, requests, imagesize, orjson
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
 from PIL import Image
-from typing import List, Dict
+from typing import List, Dict, Optional, Union
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv()
 # =========================
@@ -53,18 +59,54 @@ OUTPUT_PATH = os.path.join(BASE_DIR, "azure_to_labelstudio.json")
 
 LABEL_STUDIO_PID = "labelstudio.pid"
 
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+PREDICT_WORKERS = 16  # 동시 예측 요청 수 (Azure RPS 한도에 맞춰 조절)
+# 축소/인코딩 프로세스 수 (Windows의 ProcessPoolExecutor는 최대 61개까지만 허용)
+PREP_WORKERS = min(os.cpu_count() or 1, 61)
+# 예측 전 긴 변을 이 크기로 축소해 업로드 용량 절감 (None이면 원본 그대로 전송)
+# bbox는 0~1 정규화 좌표라 축소해도 원본 크기 기준 COCO 변환에 영향 없음
+PREDICT_MAX_SIDE = 1024
+PREDICT_JPEG_QUALITY = 85
+
+# 🔌 예측 요청용 공유 세션 (TLS 연결 재사용 + 429/5xx 재시도)
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=PREDICT_WORKERS,
+        pool_maxsize=PREDICT_WORKERS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None,  # 예측 POST도 재시도 대상에 포함
+        ),
+    ),
+)
+SESSION.headers.update(
+    {
+        "Prediction-Key": AZURE_PREDICTION_KEY,
+        "Content-Type": "application/octet-stream",
+    }
+)
+
+# 🔌 Training API 조회용 세션 (프로젝트/Iteration 조회 시 연결 재사용)
+TRAIN_SESSION = requests.Session()
+
 
 # =================================
 # 🏷️ Custom Vision 프로젝트 이름 조회
 # ================================
+@lru_cache(maxsize=32)  # 프로젝트 이름은 실행 중 바뀌지 않으므로 캐시
 def get_customvision_project_name(
     project_id: str, endpoint: str, training_key: str
 ) -> str:
     headers = {"Training-Key": training_key}
     url = f"{endpoint}customvision/v3.3/training/projects/{project_id}"
-    res = requests.get(url, headers=headers)
+    res = TRAIN_SESSION.get(url, headers=headers)
     res.raise_for_status()
-    return res.json()["name"]
+    return orjson.loads(res.content)["name"]
 
 
 # ===============================
@@ -90,9 +132,9 @@ def get_latest_published_iteration_url(
     training_endpoint = endpoint.replace("-prediction", "")
     headers = {"Training-Key": training_key}
     url = f"{training_endpoint}customvision/v3.3/training/projects/{project_id}/iterations"
-    res = requests.get(url, headers=headers)
+    res = TRAIN_SESSION.get(url, headers=headers)
     res.raise_for_status()
-    iterations = res.json()
+    iterations = orjson.loads(res.content)
 
     published = [it for it in iterations if it.get("publishName")]
     if not published:
@@ -110,31 +152,94 @@ def get_latest_published_iteration_url(
     return f"{AZURE_PREDICTION_ENDPOINT}customvision/v3.0/Prediction/{project_id}/detect/iterations/{iteration_name}/image"
 
 
+# =========================
+# 🗜️ 예측용 이미지 축소
+# =========================
+def shrink_for_prediction(
+    image_path: str, max_side: int = PREDICT_MAX_SIDE
+) -> Optional[bytes]:
+    """
+    긴 변이 max_side보다 큰 이미지를 JPEG draft(디코딩 단계 축소) 후 리사이즈하여
+    재인코딩한 바이트를 반환합니다.
+
+    Args:
+        image_path (str): 로컬 이미지 경로
+        max_side (int): 허용할 최대 긴 변 길이 (None이면 축소하지 않음)
+
+    Returns:
+        Optional[bytes]: 축소된 JPEG 데이터, 축소가 필요 없으면 None
+    """
+    if max_side:
+        with Image.open(image_path) as img:
+            if max(img.size) > max_side:
+                img.draft("RGB", (max_side, max_side))  # JPEG은 IDCT 스케일링으로 축소 디코딩
+                img = img.convert("RGB")
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+                buf = io.BytesIO()
+                img.save(buf, format="JPEG", quality=PREDICT_JPEG_QUALITY)
+                return buf.getvalue()
+    return None
+
+
 # =========================
 # 🧠 이미지 예측 수행
 # =========================
-def predict_image(image_path: str, prediction_url: str) -> dict:
+def predict_image(
+    image_path: str,
+    prediction_url: str,
+    session: requests.Session = SESSION,
+    payload: Optional[bytes] = None,
+    shrink: bool = True,
+) -> dict:
     """
     지정된 이미지에 대해 Azure Prediction API를 호출하여 예측 결과를 반환합니다.
 
     Args:
         image_path (str): 로컬 이미지 경로
         prediction_url (str): 예측용 Iteration URL
+        session (requests.Session): 요청에 사용할 세션 (기본값: 공유 SESSION)
+        payload (Optional[bytes]): 미리 축소/인코딩된 이미지 데이터 (없으면 원본 파일 전송)
+        shrink (bool): payload가 없을 때 여기서 축소 여부를 판단할지 여부
 
     Returns:
         dict: 예측 결과 JSON
     """
-    with open(image_path, "rb") as f:
-        response = requests.post(
-            prediction_url,
-            headers={
-                "Prediction-Key": AZURE_PREDICTION_KEY,
-                "Content-Type": "application/octet-stream",
-            },
-            data=f,
-        )
+    if payload is None and shrink:
+        payload = shrink_for_prediction(image_path)
+    if payload is not None:
+        response = session.post(prediction_url, data=payload)
+    else:
+        # 원본은 mmap으로 복사 없이 전송 (memoryview라 재시도 시에도 처음부터 다시 전송됨)
+        with open(image_path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm, memoryview(mm) as view:
+            response = session.post(prediction_url, data=view)
     response.raise_for_status()  # 200~299가 아니면 여기서 에러 발생!
-    return response.json()
+    return orjson.loads(response.content)
+
+
+# =========================
+# 📐 이미지 크기 조회
+# =========================
+def get_image_size(image_path: str) -> tuple:
+    """
+    이미지 헤더만 읽어 (width, height)를 반환합니다.
+    imagesize가 지원하지 않는 포맷이면 Pillow로 대체합니다.
+
+    Args:
+        image_path (str): 로컬 이미지 경로
+
+    Returns:
+        tuple: (width, height)
+    """
+    try:
+        width, height = imagesize.get(image_path)
+    except Exception:
+        width, height = -1, -1
+    if width <= 0 or height <= 0:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    return width, height
 
 
 # =========================
@@ -143,6 +248,9 @@ def predict_image(image_path: str, prediction_url: str) -> dict:
 def convert_to_coco(images: List[str], prediction_url: str) -> dict:
     """
     이미지 리스트와 예측 결과를 기반으로 COCO 포맷으로 변환합니다.
+    크기 조회는 헤더만 읽어 바로 수행하고, 축소가 필요한 이미지의 축소/인코딩은
+    프로세스 풀에서, 예측 요청은 스레드 풀에서 동시에 수행하며,
+    annotation ID는 이미지 순서대로 부여합니다.
 
     Args:
         images (List[str]): 이미지 경로 리스트
@@ -158,37 +266,96 @@ def convert_to_coco(images: List[str], prediction_url: str) -> dict:
     }
     ann_id = 1
 
+    sizes, predictions = {}, {}
+    with ProcessPoolExecutor(max_workers=PREP_WORKERS) as prep_pool, ThreadPoolExecutor(
+        max_workers=PREDICT_WORKERS
+    ) as http_pool:
+        try:
+            # 📐 크기는 헤더만 읽으면 되므로 여기서 바로 조회하고,
+            # 🗜️ 축소가 필요한 이미지만 프로세스 풀로 보내 여러 코어에서 병렬 처리
+            prep_futures, http_futures = {}, {}
+            for img_id, img_path in enumerate(images, 1):
+                sizes[img_id] = get_image_size(img_path)
+                if PREDICT_MAX_SIDE and max(sizes[img_id]) > PREDICT_MAX_SIDE:
+                    future = prep_pool.submit(shrink_for_prediction, img_path)
+                    prep_futures[future] = img_id
+                else:
+                    http_future = http_pool.submit(
+                        predict_image, img_path, prediction_url, shrink=False
+                    )
+                    http_futures[http_future] = img_id
+            # 🧠 축소가 끝난 이미지부터 바로 예측 요청 (CPU 작업과 네트워크 대기를 겹침)
+            for future in as_completed(prep_futures):
+                img_id = prep_futures[future]
+                payload = future.result()
+                http_future = http_pool.submit(
+                    predict_image,
+                    images[img_id - 1],
+                    prediction_url,
+                    payload=payload,
+                    shrink=False,
+                )
+                http_futures[http_future] = img_id
+
+            for future in as_completed(http_futures):
+                predictions[http_futures[future]] = future.result()
+        except BaseException:
+            # ❌ 첫 실패(잘못된 키/URL 등)에서 대기 중인 작업을 취소해 바로 에러를 올림
+            http_pool.shutdown(wait=False, cancel_futures=True)
+            prep_pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    # 📐 이미지 정보는 img_id 순서대로 추가
     for img_id, img_path in enumerate(images, 1):
-        with Image.open(img_path) as img:
-            width, height = img.size
-        file_name = os.path.basename(img_path)
-
+        width, height = sizes[img_id]
         coco["images"].append(
-            {"id": img_id, "file_name": file_name, "width": width, "height": height}
+            {
+                "id": img_id,
+                "file_name": os.path.basename(img_path),
+                "width": width,
+                "height": height,
+            }
         )
 
-        prediction = predict_image(img_path, prediction_url)
-        for pred in prediction["predictions"]:
+    # 🧾 img_id 순서대로 annotation 추가 (ann_id 안정성 유지)
+    for image_info in coco["images"]:
+        img_id = image_info["id"]
+        width, height = image_info["width"], image_info["height"]
+
+        kept = [
+            pred
+            for pred in predictions[img_id]["predictions"]
+            if pred["tagName"] in LABEL_INFO
+            and pred["probability"] >= LABEL_INFO[pred["tagName"]]["threshold"]
+        ]
+        if not kept:
+            continue
+
+        # 📏 정규화 bbox → 픽셀 좌표를 이미지 단위로 한 번에 계산
+        boxes = np.array(
+            [
+                [
+                    pred["boundingBox"]["left"],
+                    pred["boundingBox"]["top"],
+                    pred["boundingBox"]["width"],
+                    pred["boundingBox"]["height"],
+                ]
+                for pred in kept
+            ],
+            dtype=np.float64,
+        ) * np.array([width, height, width, height], dtype=np.float64)
+        areas = boxes[:, 2] * boxes[:, 3]
+
+        for pred, (x, y, w, h), area in zip(kept, boxes.tolist(), areas.tolist()):
             label = pred["tagName"]
             prob = pred["probability"]
-            if label not in LABEL_INFO or prob < LABEL_INFO[label]["threshold"]:
-                continue
-
-            bbox = pred["boundingBox"]
-            x, y, w, h = (
-                bbox["left"] * width,
-                bbox["top"] * height,
-                bbox["width"] * width,
-                bbox["height"] * height,
-            )
-
             coco["annotations"].append(
                 {
                     "id": ann_id,
                     "image_id": img_id,
                     "category_id": LABEL_INFO[label]["id"],
                     "bbox": [x, y, w, h],
-                    "area": w * h,
+                    "area": area,
                     "iscrowd": 0,
                     "score": prob,
                 }
@@ -198,55 +365,107 @@ def convert_to_coco(images: List[str], prediction_url: str) -> dict:
     return coco
 
 
+# =========================
+# 🗂️ COCO 인덱스
+# =========================
+@dataclass
+class CocoIndex:
+    """COCO 딕셔너리에서 id 기반 조회용 인덱스를 한 번만 만들어 재사용합니다."""
+
+    images: Dict[int, dict]  # {image_id: image_info}
+    categories: Dict[int, str]  # {category_id: category_name}
+    annotations: List[dict]
+
+
+def index_coco(coco: Union[dict, CocoIndex]) -> CocoIndex:
+    """
+    COCO 딕셔너리를 CocoIndex로 변환합니다. 이미 CocoIndex면 그대로 반환합니다.
+
+    Args:
+        coco (dict | CocoIndex): COCO 포맷 딕셔너리 또는 인덱스
+
+    Returns:
+        CocoIndex: images/categories 조회 딕셔너리가 포함된 인덱스
+    """
+    if isinstance(coco, CocoIndex):
+        return coco
+    return CocoIndex(
+        images={img["id"]: img for img in coco["images"]},
+        categories={cat["id"]: cat["name"] for cat in coco["categories"]},
+        annotations=coco["annotations"],
+    )
+
+
 # =========================
 # 🧾 Label Studio 포맷 변환
 # =========================
-def convert_to_labelstudio(coco: dict) -> List[dict]:
+def convert_to_labelstudio(coco: Union[dict, CocoIndex]) -> List[dict]:
     """
     COCO 포맷을 Label Studio JSON 포맷으로 변환합니다.
 
     Args:
-        coco (dict): COCO 포맷 딕셔너리
+        coco (dict | CocoIndex): COCO 포맷 딕셔너리 또는 index_coco() 결과
 
     Returns:
         List[dict]: Label Studio에서 사용하는 태스크 리스트 JSON
     """
-    images = {img["id"]: img for img in coco["images"]}
-    categories = {cat["id"]: cat["name"] for cat in coco["categories"]}
+    index = index_coco(coco)
+    categories = index.categories
+    # 이미지별 경로/크기/퍼센트 변환 계수를 한 번만 계산
+    per_image = {
+        img["id"]: (
+            f"/data/local-files/?d={IMAGE_FOLDER}/{img['file_name']}".replace("\\", "/"),
+            img["width"],
+            img["height"],
+            100.0 / img["width"],
+            100.0 / img["height"],
+        )
+        for img in index.images.values()
+    }
     task_map: Dict[str, dict] = {}
+    result_lists: Dict[str, list] = {}
 
-    for ann in coco["annotations"]:
-        image_info = images[ann["image_id"]]
-        file_path = (
-            f"/data/local-files/?d={IMAGE_FOLDER}/{image_info['file_name']}".replace(
-                "\\", "/"
-            )
-        )
+    annotations = index.annotations
+    if not annotations:
+        return []
 
-        if file_path not in task_map:
+    # 📏 bbox → 퍼센트 좌표 변환을 전체 annotation에 대해 한 번에 계산
+    bboxes = np.array([ann["bbox"] for ann in annotations], dtype=np.float64)
+    scales = np.array(
+        [per_image[ann["image_id"]][3:] for ann in annotations], dtype=np.float64
+    )
+    percents = np.round(bboxes * np.tile(scales, 2), 2).tolist()
+
+    for ann, (x, y, w, h) in zip(annotations, percents):
+        file_path, width, height, _, _ = per_image[ann["image_id"]]
+
+        result_list = result_lists.get(file_path)
+        if result_list is None:
+            result_list = []
             task_map[file_path] = {
                 "data": {"image": file_path},
-                "annotations": [{"result": []}],
+                "annotations": [{"result": result_list}],
             }
-
-        x, y, w, h = ann["bbox"]
-        result = {
-            "original_width": image_info["width"],
-            "original_height": image_info["height"],
-            "image_rotation": 0,
-            "value": {
-                "x": round(x / image_info["width"] * 100, 2),
-                "y": round(y / image_info["height"] * 100, 2),
-                "width": round(w / image_info["width"] * 100, 2),
-                "height": round(h / image_info["height"] * 100, 2),
-                "rotation": 0,
-                "rectanglelabels": [categories[ann["category_id"]]],
-            },
-            "from_name": "label",
-            "to_name": "image",
-            "type": "rectanglelabels",
-        }
-        task_map[file_path]["annotations"][0]["result"].append(result)
+            result_lists[file_path] = result_list
+
+        result_list.append(
+            {
+                "original_width": width,
+                "original_height": height,
+                "image_rotation": 0,
+                "value": {
+                    "x": x,
+                    "y": y,
+                    "width": w,
+                    "height": h,
+                    "rotation": 0,
+                    "rectanglelabels": [categories[ann["category_id"]]],
+                },
+                "from_name": "label",
+                "to_name": "image",
+                "type": "rectanglelabels",
+            }
+        )
 
     return list(task_map.values())
 
@@ -305,12 +524,13 @@ def run_label_studio():
 # 📦 예측 수행 및 라벨 포맷 변환
 # ===========================
 def predict_to_labelstudio():
-    # 🔍 로컬 이미지 목록 수집
-    images = [
-        os.path.join(IMAGE_FOLDER, f)
-        for f in os.listdir(IMAGE_FOLDER)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ]
+    # 🔍 로컬 이미지 목록 수집 (정렬하여 img_id를 실행마다 동일하게 유지)
+    with os.scandir(IMAGE_FOLDER) as it:
+        images = sorted(
+            entry.path
+            for entry in it
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        )
 
     print(f"📁 총 이미지 개수: {len(images)}")
 
@@ -328,8 +548,8 @@ def predict_to_labelstudio():
     label_data = convert_to_labelstudio(coco)
 
     # 💾 변환된 결과를 JSON 파일로 저장
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(label_data, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_PATH, "wb") as f:
+        f.write(orjson.dumps(label_data, option=orjson.OPT_INDENT_2))
 
     print("✅ 변환 완료: COCO & LabelStudio JSON")
 
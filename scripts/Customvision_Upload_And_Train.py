@@ -16,9 +16,13 @@
 
 """
 
-import os, json, base64, requests, time
+import os, re, base64, mmap, requests, threading, time, orjson
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 import Customvision_Predict_To_Labelstudio as ptl
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv()
 # =========================
@@ -41,6 +45,51 @@ BASE_DIR = ptl.BASE_DIR
 IMAGE_FOLDER = ptl.IMAGE_FOLDER
 COCO_FILE_PATH = os.path.join(BASE_DIR, "result.json")
 
+UPLOAD_BATCH_SIZE = 64  # 한 번에 업로드할 이미지 수 (Azure images/files 최대 64장)
+ENCODE_WORKERS = 8  # 이미지 읽기 + base64 인코딩 스레드 수
+UPLOAD_WORKERS = 4  # 동시에 전송할 배치 수 (Azure rate limit 고려)
+
+# 🔌 Training API 공유 세션 (TLS 연결 재사용 + 429/5xx 재시도, 업로드 외 모든 호출에서 사용)
+# 기본 allowed_methods는 POST를 재시도하지 않으므로 /train, /publish 요청은 한 번만 전송되고,
+# raise_on_status=False로 재시도 소진 시에도 응답을 돌려받아 각 함수의 상태 코드 분기가 동작
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        ),
+    ),
+)
+SESSION.headers.update(TRAIN_HEADERS)
+
+# 📤 images/files 배치 업로드 전용 세션
+# 중복 이미지는 Azure가 무시하므로 POST도 재시도하고,
+# 재시도를 다 써도 예외 대신 마지막 응답을 돌려받아 상태 코드만 기록하고 계속 진행
+UPLOAD_SESSION = requests.Session()
+UPLOAD_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_maxsize=UPLOAD_WORKERS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None,
+            raise_on_status=False,
+        ),
+    ),
+)
+UPLOAD_SESSION.headers.update(TRAIN_HEADERS)
+
+_print_lock = threading.Lock()  # 업로드 스레드 간 로그 출력이 섞이지 않도록
+
+_ITERATION_RE = re.compile(r"^Iteration\s*(\d+)$")  # "Iteration 12" → 12
+
 
 # =========================
 # 📛 Iteration 이름 자동 생성
@@ -54,20 +103,16 @@ def get_next_iteration_name():
         str: 자동 생성된 새로운 Iteration 이름
     """
     url = f"{AZURE_TRAINING_ENDPOINT}customvision/v3.3/training/projects/{AZURE_TRAINING_PROJECT_ID}/iterations"
-    res = requests.get(url, headers=TRAIN_HEADERS)
+    res = SESSION.get(url)
     res.raise_for_status()
-    iterations = res.json()
+    iterations = orjson.loads(res.content)
 
-    max_num = 0
-    for it in iterations:
-        name = it["name"]
-        if name.startswith("Iteration"):
-            try:
-                num = int(name.replace("Iteration", "").strip())
-                max_num = max(max_num, num)
-            except:
-                continue
-    return f"Iteration {max_num + 1}"
+    nums = (
+        int(m.group(1))
+        for it in iterations
+        if (m := _ITERATION_RE.match(it["name"].strip()))
+    )
+    return f"Iteration {max(nums, default=0) + 1}"
 
 
 # =========================
@@ -81,9 +126,9 @@ def get_tag_mapping():
         dict: {태그이름: 태그ID} 형태의 매핑
     """
     url = f"{AZURE_TRAINING_ENDPOINT}customvision/v3.3/training/projects/{AZURE_TRAINING_PROJECT_ID}/tags"
-    res = requests.get(url, headers=TRAIN_HEADERS)
+    res = SESSION.get(url)
     res.raise_for_status()
-    return {tag["name"]: tag["id"] for tag in res.json()}
+    return {tag["name"]: tag["id"] for tag in orjson.loads(res.content)}
 
 
 # =========================
@@ -95,87 +140,146 @@ def convert_coco_to_azure_uploads(coco, tag_map):
     (bounding box → normalized region)
 
     Args:
-        coco (dict): COCO 형식 라벨 JSON
+        coco (dict | ptl.CocoIndex): COCO 형식 라벨 JSON 또는 ptl.index_coco() 결과
         tag_map (dict): {카테고리명: 태그ID} 매핑 정보
 
     Returns:
         dict: {파일명: [region, ...]} 형태의 업로드 데이터
     """
-    uploads = {}
-    images = {img["id"]: img for img in coco["images"]}
-    categories = {cat["id"]: cat["name"] for cat in coco["categories"]}
-
-    for ann in coco["annotations"]:
-        image_info = images[ann["image_id"]]
-        file_name = image_info["file_name"]
-        width, height = image_info["width"], image_info["height"]
-        category_name = categories[ann["category_id"]]
-
-        if category_name not in tag_map:
+    index = ptl.index_coco(coco)
+    uploads = defaultdict(list)
+    # 이미지별 파일명과 정규화 계수(1/width, 1/height)를 한 번만 계산
+    images = {
+        img_id: (img["file_name"], 1.0 / img["width"], 1.0 / img["height"])
+        for img_id, img in index.images.items()
+    }
+    # Azure에 태그가 있는 카테고리만 {category_id: 태그ID}로 미리 매핑
+    tag_ids = {
+        cat_id: tag_map[name]
+        for cat_id, name in index.categories.items()
+        if name in tag_map
+    }
+
+    for ann in index.annotations:
+        tag_id = tag_ids.get(ann["category_id"])
+        if tag_id is None:
             continue
 
+        file_name, iw, ih = images[ann["image_id"]]
         x, y, w, h = ann["bbox"]
-        region = {
-            "tagId": tag_map[category_name],
-            "left": x / width,
-            "top": y / height,
-            "width": w / width,
-            "height": h / height,
-        }
-
-        if file_name not in uploads:
-            uploads[file_name] = []
-        uploads[file_name].append(region)
+        uploads[file_name].append(
+            {
+                "tagId": tag_id,
+                "left": x * iw,
+                "top": y * ih,
+                "width": w * iw,
+                "height": h * ih,
+            }
+        )
 
-    return uploads
+    return dict(uploads)
 
 
 # =========================
 # 📤 이미지 + 라벨 업로드
 # =========================
+def encode_image(fpath):
+    """
+    이미지 파일을 mmap으로 열어 복사 없이 base64 문자열로 인코딩합니다.
+
+    Args:
+        fpath (str): 이미지 파일 경로
+
+    Returns:
+        str: base64로 인코딩된 이미지 내용
+    """
+    with open(fpath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # 빈 파일은 mmap 불가
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return base64.b64encode(mm).decode("ascii")
+
+
 def upload_to_custom_vision(uploads):
     """
     변환된 이미지-라벨 데이터들을 Azure에 업로드합니다.
-    50개 단위로 나눠 전송합니다.
+    UPLOAD_BATCH_SIZE 단위로 나눠 최대 UPLOAD_WORKERS개 배치를 동시에 전송하며,
+    전송하는 동안 다음 배치의 인코딩을 스레드 풀에서 미리 수행합니다.
 
     Args:
         uploads (dict): {파일명: [region, ...]} 형태의 업로드 정보
     """
-    batch, sent = [], 0
+    items = []
     for fname, regions in uploads.items():
         fpath = os.path.join(IMAGE_FOLDER, fname)
         if not os.path.exists(fpath):
             print(f"❌ {fname} 없음")
             continue
-        with open(fpath, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        batch.append({"name": fname, "contents": b64, "regions": regions})
+        items.append((fname, regions, fpath))
+
+    chunks = [
+        items[i : i + UPLOAD_BATCH_SIZE]
+        for i in range(0, len(items), UPLOAD_BATCH_SIZE)
+    ]
+    if not chunks:
+        return
+
+    with ThreadPoolExecutor(max_workers=ENCODE_WORKERS) as encoder, ThreadPoolExecutor(
+        max_workers=UPLOAD_WORKERS
+    ) as uploader:
+        pending = [encoder.submit(encode_image, fpath) for _, _, fpath in chunks[0]]
+        in_flight = set()
+        for i, chunk in enumerate(chunks):
+            batch = [
+                {"name": fname, "contents": future.result(), "regions": regions}
+                for (fname, regions, _), future in zip(chunk, pending)
+            ]
+            # 다음 배치 인코딩을 미리 시작
+            pending = (
+                [encoder.submit(encode_image, fpath) for _, _, fpath in chunks[i + 1]]
+                if i + 1 < len(chunks)
+                else []
+            )
+            # 전송 중인 배치가 가득 차면 하나가 끝날 때까지 대기 (메모리 상한 유지)
+            if len(in_flight) >= UPLOAD_WORKERS:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            in_flight.add(
+                uploader.submit(
+                    send_batch, batch, i * UPLOAD_BATCH_SIZE, UPLOAD_SESSION
+                )
+            )
 
-        if len(batch) == 50:
-            sent = send_batch(batch, sent)
-            batch = []
-    if batch:
-        send_batch(batch, sent)
+        for future in as_completed(in_flight):
+            future.result()
 
 
-def send_batch(batch, sent):
+def send_batch(batch, sent, session=UPLOAD_SESSION):
     """
-    50개 단위의 배치를 실제 업로드하는 함수
+    UPLOAD_BATCH_SIZE 단위의 배치를 실제 업로드하는 함수
 
     Args:
         batch (list): 업로드할 이미지 리스트
-        sent (int): 현재까지 업로드한 수
+        sent (int): 이 배치 앞까지의 이미지 수 (로그 출력용 오프셋)
+        session (requests.Session): 요청에 사용할 세션
 
     Returns:
-        int: 업로드 완료된 총 수
+        int: 이 배치까지 포함한 누적 이미지 수
     """
     url = f"{AZURE_TRAINING_ENDPOINT}customvision/v3.3/training/projects/{AZURE_TRAINING_PROJECT_ID}/images/files"
-    res = requests.post(url, headers=TRAIN_HEADERS, json={"images": batch}, timeout=120)
-    print(f"[{sent + 1}–{sent + len(batch)}] ▶ {res.status_code}")
-    try:
-        print(json.dumps(res.json(), indent=2, ensure_ascii=False)[:300])
-    except:
-        print(res.text[:300])
+    res = session.post(url, data=orjson.dumps({"images": batch}), timeout=120)
+    detail = None
+    if res.status_code >= 400:  # 성공 시에는 응답 본문 파싱/출력 생략
+        try:
+            body = orjson.dumps(orjson.loads(res.content), option=orjson.OPT_INDENT_2)
+            detail = body.decode()[:300]
+        except:
+            detail = res.text[:300]
+    with _print_lock:
+        print(f"[{sent + 1}–{sent + len(batch)}] ▶ {res.status_code}")
+        if detail:
+            print(detail)
     return sent + len(batch)
 
 
@@ -194,7 +298,7 @@ def train_new_iteration(iteration_name):
         f"{AZURE_TRAINING_ENDPOINT}customvision/v3.3/training/projects/{AZURE_TRAINING_PROJECT_ID}/train"
         f"?iterationName={iteration_name}&advancedTraining={'true' if USE_ADVANCED_TRAINING else 'false'}"
     )
-    res = requests.post(url, headers=TRAIN_HEADERS)
+    res = SESSION.post(url)
 
     print(f"\n🧠 [Iteration 학습 요청]")
     print(f"📡 요청 URL: {url}")  # ✅ 이 줄만 추가해도 디버깅이 한결 쉬워짐
@@ -214,29 +318,39 @@ def train_new_iteration(iteration_name):
 # =========================
 
 
-def wait_for_training_completion(iteration_name, timeout=96 * 3600, interval=30):
+def wait_for_training_completion(
+    iteration_name, timeout=96 * 3600, interval=10, max_interval=300
+):
     """
     학습 요청 후 일정 시간 동안 학습 완료 여부를 polling 방식으로 확인합니다.
+    체크 간격은 interval부터 1.5배씩 늘어나 max_interval까지 커지며,
+    상태가 바뀌면(예: New → Training) 다시 interval로 초기화됩니다.
 
     Args:
         iteration_name (str): 모니터링할 Iteration 이름
         timeout (int): 최대 대기 시간 (초)
-        interval (int): 상태 체크 간격 (초)
+        interval (int): 최초 상태 체크 간격 (초)
+        max_interval (int): 최대 상태 체크 간격 (초)
 
     Returns:
         bool: 학습이 완료되었으면 True, 실패/취소/타임아웃이면 False
     """
     url = f"{AZURE_TRAINING_ENDPOINT}customvision/v3.3/training/projects/{AZURE_TRAINING_PROJECT_ID}/iterations"
     start_time = time.time()
+    delay = interval
+    last_status = None
 
     while time.time() - start_time < timeout:
-        res = requests.get(url, headers=TRAIN_HEADERS)
+        res = SESSION.get(url)
         res.raise_for_status()
-        iterations = res.json()
+        iterations = orjson.loads(res.content)
 
         for it in iterations:
             if it["name"] == iteration_name:
                 status = it["status"]
+                if status != last_status:
+                    delay = interval  # 상태 전환 시 간격 초기화
+                    last_status = status
 
                 elapsed = time.time() - start_time
                 hours = int(elapsed // 3600)  # 경과 ‘시’
@@ -255,7 +369,10 @@ def wait_for_training_completion(iteration_name, timeout=96 * 3600, interval=30)
                 elif status in ["Failed", "Canceled"]:
                     print(f"❌ 학습 실패 또는 취소됨: {status}")
                     return False
-        time.sleep(interval)
+
+        remaining = timeout - (time.time() - start_time)
+        time.sleep(max(0, min(delay, remaining)))
+        delay = min(delay * 1.5, max_interval)
 
     print("❗ 학습 완료까지 기다리다 타임아웃됨")
     return False
@@ -274,11 +391,11 @@ def publish_iteration(
 
     # 1) Iteration 목록 조회
     it_url = f"{AZURE_TRAINING_ENDPOINT}/customvision/v3.3/training/projects/{AZURE_TRAINING_PROJECT_ID}/iterations"
-    it_res = requests.get(it_url, headers=TRAIN_HEADERS)
+    it_res = SESSION.get(it_url)
     it_res.raise_for_status()
 
     iteration_id = None
-    for it in it_res.json():
+    for it in orjson.loads(it_res.content):
         if it["name"] == iteration_name:
             iteration_id = it["id"]
             break
@@ -294,7 +411,7 @@ def publish_iteration(
         f"&publishName={publish_name or iteration_name}"
     )
 
-    res = requests.post(publish_url, headers=TRAIN_HEADERS)  # body 없이!
+    res = SESSION.post(publish_url)  # body 없이!
     if res.ok:
         print(f"✅ 퍼블리시 완료: {publish_name or iteration_name}")
     else:
@@ -307,8 +424,8 @@ def publish_iteration(
 # =========================
 def upload_and_train():
     # 📂 COCO 라벨 파일 로드
-    with open(COCO_FILE_PATH, encoding="utf-8") as f:
-        coco = json.load(f)
+    with open(COCO_FILE_PATH, "rb") as f:
+        coco = orjson.loads(f.read())
     print(f"📁 이미지 수: {len(coco['images'])} / 라벨 수: {len(coco['annotations'])}")
 
     # 🏷️ 프로젝트 내 태그 목록 조회 및 매핑
@@ -1,18 +1,28 @@
 import gradio as gr
 import requests
-import json
 from PIL import Image, ImageDraw, ImageFont
 import io
-import datetime
 import pandas as pd
+import matplotlib
+
+matplotlib.use("Agg")  # GUI 백엔드 초기화 없이 서버에서 렌더링
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib import font_manager
 import numpy as np
 import os
 import tempfile
 from dotenv import load_dotenv
 import uuid
-import tabulate
+import functools
+import itertools
+import hashlib
+import threading
+import atexit
+import shutil
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
@@ -31,78 +41,150 @@ TRENDING_MODEL = {
 }
 
 LABELS = ["텍스트", "브랜드/로고", "인물", "캐릭터"]
+BBOX_KEYS = ("left", "top", "width", "height")
+# Azure 업로드 전 JPEG 축소 설정 (Custom Vision 최소 입력 256px보다 충분히 큼)
+UPLOAD_MAX_SIDE = 800
+UPLOAD_JPEG_QUALITY = 80
+
+# 종합 점수 계산 시 태그별 가중치 (목록에 없는 태그는 1.0)
+TAG_WEIGHTS = {"인물": 1.2, "텍스트": 1.1, "브랜드/로고": 1.0, "캐릭터": 0.9}
+
+# 같은 썸네일을 다시 분석할 때 Azure 재호출을 막는 예측 결과 캐시
+# key: (published_name, 이미지 sha256) / value: 예측 결과 JSON
+PREDICTION_CACHE_SIZE = 512
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()
+
+# 두 모델 예측을 동시에 보내기 위한 스레드 풀과 TLS 연결을 재사용하는 공유 세션
+_POOL = ThreadPoolExecutor(max_workers=4)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# 리포트 파일은 전용 임시 폴더에 최근 MAX_REPORTS개만 유지하고 종료 시 삭제
+MAX_REPORTS = 32
+REPORT_DIR = tempfile.mkdtemp(prefix="thumbnail_reports_")
+_report_dirs = deque()
+_report_lock = threading.Lock()
+atexit.register(shutil.rmtree, REPORT_DIR, ignore_errors=True)
 
 try:
-    font_path = next(
-        (
-            f.fname
-            for f in font_manager.fontManager.ttflist
-            if "Malgun Gothic" in f.name
-            or "AppleGothic" in f.name
-            or "NanumGothic" in f.name
+    # matplotlib의 폰트 캐시를 이용해 한 번의 조회로 한글 폰트 경로 확보
+    font_path = font_manager.findfont(
+        font_manager.FontProperties(
+            family=["Malgun Gothic", "AppleGothic", "NanumGothic"]
         ),
-        None,
+        fallback_to_default=False,
     )
-    if font_path is None:
-        raise IOError
     plt.rcParams["font.family"] = font_manager.FontProperties(
         fname=font_path
     ).get_name()
     plt.rcParams["axes.unicode_minus"] = False
-    label_font = ImageFont.truetype(font_path, 20)
-except IOError:
+except ValueError:
     print("경고: 한글 폰트를 찾을 수 없습니다.")
-    label_font = ImageFont.load_default()
+    font_path = None
 
 
-# ✅ 약관 HTML 파일 불러오기 함수
-def get_terms_html(opened=False):
+@functools.lru_cache(maxsize=1)
+def get_label_font():
+    """바운딩 박스 라벨용 폰트를 처음 그릴 때 한 번만 로드합니다."""
+    if font_path is None:
+        return ImageFont.load_default()
     try:
-        with open("terms.html", "r", encoding="utf-8") as f:
-            body = f.read()
+        return ImageFont.truetype(font_path, 20)
+    except IOError:
+        print("경고: 한글 폰트를 불러올 수 없습니다.")
+        return ImageFont.load_default()
 
-        html_id = f"terms-details-{uuid.uuid4().hex}"  # 매번 고유 ID
-        if opened:
-            return f"""
-<details id="{html_id}" open>
-  <summary>📄 이용약관 및 개인정보처리방침 (필수 동의)</summary>
-  {body}
-</details>
-"""
-        else:
-            return f"""
-<details id="{html_id}">
+
+# ✅ 약관 HTML은 시작 시 한 번만 읽어둠
+try:
+    with open("terms.html", "r", encoding="utf-8") as f:
+        _TERMS_BODY = f.read()
+except FileNotFoundError:
+    _TERMS_BODY = None
+
+# 같은 값으로 업데이트하면 화면이 다시 그려지지 않아 약관이 접히지 않으므로
+# 호출마다 다른 ID를 붙임 (uuid 대신 가벼운 카운터 사용)
+_terms_ids = itertools.count()
+
+
+# ✅ 약관 HTML 생성 함수
+def get_terms_html(opened=False):
+    if _TERMS_BODY is None:
+        return "<p style='color:red;'>⚠️ 약관 파일을 찾을 수 없습니다.</p>"
+
+    html_id = f"terms-details-{next(_terms_ids)}"
+    open_attr = " open" if opened else ""
+    return f"""
+<details id="{html_id}"{open_attr}>
   <summary>📄 이용약관 및 개인정보처리방침 (필수 동의)</summary>
-  {body}
+  {_TERMS_BODY}
 </details>
 """
-    except FileNotFoundError:
-        return "<p style='color:red;'>⚠️ 약관 파일을 찾을 수 없습니다.</p>"
+
+
+def encode_jpeg(image):
+    """
+    PIL 이미지를 업로드용 JPEG 바이트로 한 번만 인코딩합니다.
+    Custom Vision은 내부적으로 축소하므로 긴 변을 UPLOAD_MAX_SIDE로 줄여 전송량을 절감합니다.
+    (bbox는 0~1 정규화 좌표라 원본 이미지에 그대로 그릴 수 있음)
+    """
+    if image.mode != "RGB":  # RGBA/P 모드 PNG는 JPEG로 바로 저장할 수 없음
+        image = image.convert("RGB")
+    w, h = image.size
+    scale = min(1.0, UPLOAD_MAX_SIDE / max(w, h))
+    if scale < 1:
+        image = image.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=False)
+    return buf.getvalue()
 
 
 def predict_with_model(image, model_config):
+    return predict_with_model_bytes(encode_jpeg(image), model_config)
+
+
+def predict_with_model_bytes(img_byte_arr, model_config):
     prediction_url = f"{model_config['endpoint']}customvision/v3.0/Prediction/{model_config['project_id']}/detect/iterations/{model_config['published_name']}/image"
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format="JPEG")
-    img_byte_arr = img_byte_arr.getvalue()
+
+    # ✅ 같은 이미지 + 같은 모델이면 캐시된 결과 반환 (임계값은 클라이언트에서 적용)
+    cache_key = (
+        model_config["published_name"],
+        hashlib.sha256(img_byte_arr).hexdigest(),
+    )
+    with _prediction_cache_lock:
+        if cache_key in _prediction_cache:
+            _prediction_cache.move_to_end(cache_key)
+            return _prediction_cache[cache_key]
+
     headers = {
         "Prediction-Key": model_config["key"],
         "Content-Type": "application/octet-stream",
     }
-    response = requests.post(prediction_url, headers=headers, data=img_byte_arr)
+    response = _SESSION.post(prediction_url, headers=headers, data=img_byte_arr)
     response.raise_for_status()
-    return response.json()
+    result = response.json()
+
+    with _prediction_cache_lock:
+        _prediction_cache[cache_key] = result
+        if len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
+    return result
 
 
 def calculate_similarity_score(predictions):
-    weights = {"인물": 1.2, "텍스트": 1.1, "브랜드로고": 1.0, "캐릭터": 0.9}
-    weighted_score = 0
-    total_weight = 0
-    for pred in predictions["predictions"]:
-        weight = weights.get(pred["tagName"], 1.0)
-        weighted_score += pred["probability"] * weight
-        total_weight += weight
-    return min((weighted_score / total_weight) * 100 if total_weight else 0, 100)
+    preds = predictions["predictions"]
+    if not preds:
+        return 0
+    probs = np.fromiter(
+        (p["probability"] for p in preds), dtype=np.float64, count=len(preds)
+    )
+    weights = np.fromiter(
+        (TAG_WEIGHTS.get(p["tagName"], 1.0) for p in preds),
+        dtype=np.float64,
+        count=len(preds),
+    )
+    return min(float(np.dot(probs, weights) / weights.sum()) * 100, 100)
 
 
 def generate_recommendations(viewcount_score, trending_score, predictions):
@@ -132,15 +214,25 @@ def analyze_thumbnail(image, analysis_type, threshold):
     if image is None:
         return None, "이미지를 업로드해주세요.", "", "", [], None
 
-    viewcount_result = (
-        predict_with_model(image, VIEWCOUNT_MODEL)
+    # 🗜️ JPEG 인코딩은 한 번만 하고 두 모델 호출에서 같은 바이트를 공유
+    jpeg = encode_jpeg(image)
+
+    # 🚀 두 모델 호출은 서로 독립적이므로 동시에 요청
+    viewcount_future = (
+        _POOL.submit(predict_with_model_bytes, jpeg, VIEWCOUNT_MODEL)
         if analysis_type != "트렌드 중심"
-        else {"predictions": []}
+        else None
     )
-    trending_result = (
-        predict_with_model(image, TRENDING_MODEL)
+    trending_future = (
+        _POOL.submit(predict_with_model_bytes, jpeg, TRENDING_MODEL)
         if analysis_type != "조회수 중심"
-        else {"predictions": []}
+        else None
+    )
+    viewcount_result = (
+        viewcount_future.result() if viewcount_future else {"predictions": []}
+    )
+    trending_result = (
+        trending_future.result() if trending_future else {"predictions": []}
     )
 
     viewcount_score = calculate_similarity_score(viewcount_result)
@@ -160,7 +252,10 @@ result_text = ""  # 점수 출력 라인 제거
 📈 **종합 점수**: {(viewcount_score + trending_score) / 2:.1f}%
 """
     result_text = ""
-    detailed_analysis = create_detailed_analysis(viewcount_result, trending_result)
+    # 태그별 최고 확률은 한 번만 계산해 표/차트에서 공유
+    vc_map = _best_by_tag(viewcount_result)
+    tr_map = _best_by_tag(trending_result)
+    detailed_analysis = create_detailed_analysis(vc_map, tr_map)
     recommendations = generate_recommendations(
         viewcount_score, trending_score, viewcount_result
     )
@@ -173,7 +268,7 @@ result_text = ""  # 점수 출력 라인 제거
         annotated_image,
         result_text,  # 여기는 이제 내용 없음
         detailed_analysis,
-        create_comparison_chart(viewcount_result, trending_result),
+        create_comparison_chart(vc_map, tr_map),
         recommendations_md,
         gr.update(visible=True),
         file_path,
@@ -188,6 +283,7 @@ def draw_comparison_results(
 ):
     draw = ImageDraw.Draw(image)
     width, height = image.size
+    label_font = get_label_font()
 
     label_colors = {
         "브랜드/로고": "#FF4136",
@@ -201,61 +297,72 @@ def draw_comparison_results(
         "트렌드": "#FF4136",  # 빨강
     }
 
-    def draw_prediction(pred, model_type):
-        tag = pred["tagName"]
-        bbox = pred["boundingBox"]
-        confidence = pred["probability"]
-        if confidence < threshold:
-            return
-
-        left = bbox["left"] * width
-        top = bbox["top"] * height
-        right = left + bbox["width"] * width
-        bottom = top + bbox["height"] * height
-
-        # ✅ 색상 선택 기준
-        if color_by == "label":
-            color = label_colors.get(tag, "#AAAAAA")
-        else:  # color_by == "model"
-            color = model_colors.get(model_type, "#AAAAAA")
+    scale = np.array([width, height, width, height], dtype=np.float32)
 
-        label = f"[{model_type}] {tag} {confidence:.1%}"
-
-        # 텍스트 위치 모델에 따라 다르게
-        text_xy = (
-            (left + 10, top + 5) if model_type == "조회수" else (left + 10, bottom - 35)
+    def draw_predictions(preds, model_type):
+        if not preds:
+            return
+        # 📏 임계값 필터링과 좌표 계산을 한 번에 수행
+        probs = np.array([p["probability"] for p in preds], dtype=np.float64)
+        keep = np.flatnonzero(probs >= threshold)
+        if keep.size == 0:
+            return
+        boxes = (
+            np.array(
+                [
+                    [preds[i]["boundingBox"][k] for k in BBOX_KEYS]
+                    for i in keep.tolist()
+                ],
+                dtype=np.float32,
+            )
+            * scale
         )
+        boxes[:, 2:] += boxes[:, :2]  # (left, top, w, h) → (left, top, right, bottom)
+
+        for i, (left, top, right, bottom) in zip(keep.tolist(), boxes.tolist()):
+            pred = preds[i]
+            tag = pred["tagName"]
+            confidence = pred["probability"]
+
+            # ✅ 색상 선택 기준
+            if color_by == "label":
+                color = label_colors.get(tag, "#AAAAAA")
+            else:  # color_by == "model"
+                color = model_colors.get(model_type, "#AAAAAA")
+
+            label = f"[{model_type}] {tag} {confidence:.1%}"
+
+            # 텍스트 위치 모델에 따라 다르게
+            text_xy = (
+                (left + 10, top + 5)
+                if model_type == "조회수"
+                else (left + 10, bottom - 35)
+            )
 
-        draw.rectangle([left, top, right, bottom], outline=color, width=7)
-        draw.text(text_xy, label, fill=color, font=label_font)
+            draw.rectangle([left, top, right, bottom], outline=color, width=7)
+            draw.text(text_xy, label, fill=color, font=label_font)
 
-    for pred in viewcount_result["predictions"]:
-        draw_prediction(pred, "조회수")
-    for pred in trending_result["predictions"]:
-        draw_prediction(pred, "트렌드")
+    draw_predictions(viewcount_result["predictions"], "조회수")
+    draw_predictions(trending_result["predictions"], "트렌드")
 
     return image
 
 
-def create_detailed_analysis(viewcount_result, trending_result):
+def _best_by_tag(result):
+    """예측 결과를 {tagName: 최대 probability} 딕셔너리로 한 번에 변환합니다."""
+    out = {}
+    for p in result["predictions"]:
+        tag, prob = p["tagName"], p["probability"]
+        if prob > out.get(tag, -1):
+            out[tag] = prob
+    return out
+
+
+def create_detailed_analysis(vc_map, tr_map):
     data = []
     for label in LABELS:
-        vc_score = next(
-            (
-                p["probability"]
-                for p in viewcount_result["predictions"]
-                if p["tagName"] == label
-            ),
-            0,
-        )
-        tr_score = next(
-            (
-                p["probability"]
-                for p in trending_result["predictions"]
-                if p["tagName"] == label
-            ),
-            0,
-        )
+        vc_score = vc_map.get(label, 0)
+        tr_score = tr_map.get(label, 0)
         data.append(
             {
                 "카테고리": label,
@@ -267,33 +374,23 @@ def create_detailed_analysis(viewcount_result, trending_result):
     return pd.DataFrame(data)
 
 
-def create_comparison_chart(viewcount_result, trending_result):
+def create_comparison_chart(vc_map, tr_map):
     categories = ["텍스트", "브랜드/로고", "캐릭터", "인물"]
     x = np.arange(len(categories))
-    viewcount_scores = [
-        next(
-            (
-                p["probability"]
-                for p in viewcount_result["predictions"]
-                if p["tagName"] == cat
-            ),
-            0,
-        )
-        for cat in categories
-    ]
-    trending_scores = [
-        next(
-            (
-                p["probability"]
-                for p in trending_result["predictions"]
-                if p["tagName"] == cat
-            ),
-            0,
-        )
-        for cat in categories
-    ]
+    viewcount_scores = np.fromiter(
+        (vc_map.get(cat, 0.0) for cat in categories),
+        dtype=np.float32,
+        count=len(categories),
+    )
+    trending_scores = np.fromiter(
+        (tr_map.get(cat, 0.0) for cat in categories),
+        dtype=np.float32,
+        count=len(categories),
+    )
 
-    fig, ax = plt.subplots(figsize=(10, 5))
+    # pyplot 전역 figure 목록에 쌓이지 않도록 Figure를 직접 생성
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
     ax.plot(x, viewcount_scores, marker="o", label="조회수 모델", color="#F08080")
     ax.plot(x, trending_scores, marker="s", label="트렌드 모델", color="#9C90EE")
     ax.set_xticks(x)
@@ -306,19 +403,37 @@ def create_comparison_chart(viewcount_result, trending_result):
     return fig
 
 
+def dataframe_to_markdown(df):
+    """DataFrame을 마크다운 파이프 테이블 문자열로 변환합니다 (tabulate 불필요)."""
+    header = "| " + " | ".join(str(col) for col in df.columns) + " |"
+    divider = "|" + "|".join(" --- " for _ in df.columns) + "|"
+    rows = [
+        "| " + " | ".join(str(value) for value in row) + " |"
+        for row in df.itertuples(index=False)
+    ]
+    return "\n".join([header, divider, *rows])
+
+
 def generate_report_file(result_text, detailed_df, recommendations_md):
     content = (
         result_text
         + "\n\n"
         + recommendations_md
         + "\n\n"
-        + detailed_df.to_markdown(index=False)
+        + dataframe_to_markdown(detailed_df)
     )
-    with tempfile.NamedTemporaryFile(
-        delete=False, suffix=".txt", mode="w", encoding="utf-8"
-    ) as tmp:
-        tmp.write(content)
-        return tmp.name
+    # 다운로드 파일명은 고정하고, 요청마다 하위 폴더로 구분
+    report_dir = os.path.join(REPORT_DIR, uuid.uuid4().hex)
+    os.makedirs(report_dir)
+    path = os.path.join(report_dir, "thumbnail_report.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    with _report_lock:
+        _report_dirs.append(report_dir)
+        while len(_report_dirs) > MAX_REPORTS:
+            shutil.rmtree(_report_dirs.popleft(), ignore_errors=True)
+    return path
 
 
 # ───────────────────────────────
@@ -1,13 +1,16 @@
 import os
 import re
 import time
+import shutil
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from urllib.request import urlretrieve
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,6 +23,33 @@ MONTH = 5
 
 HD_MODE = True
 USE_PERIOD_MODE = True  # True: period 기반, False: 날짜 버튼 클릭 방식
+DOWNLOAD_WORKERS = 32  # 썸네일 확인/다운로드 동시 요청 수
+HEADLESS = False  # True: 브라우저 창 없이 실행
+
+# 차트 데이터를 JSON으로 주는 Playboard XHR 주소 (브라우저 개발자도구 Network 탭에서 확인)
+# "{period}" 자리에 UTC timestamp가 들어감. 비어 있으면 Selenium 스크롤 방식 사용
+# 스크롤 시 추가로 불러오는 페이지 번호 파라미터는 "{page}"(1부터)로 표시
+PLAYBOARD_API_URL = os.getenv("PLAYBOARD_API_URL")
+API_MAX_PAGES = 50  # 페이지네이션 안전 상한
+API_FULL_CHART_SIZE = 100  # "{page}"가 없을 때 이보다 적으면 잘린 응답으로 보고 Selenium 사용
+
+# 자주 쓰는 정규식은 모듈 로드 시 한 번만 컴파일
+_URL_BG_RE = re.compile(r"url\(['\"]?(.*?)['\"]?\)")
+_VID_ID_RE = re.compile(r"/vi/([a-zA-Z0-9_-]+)/")
+_QUAL_RE = re.compile(r"(default|mqdefault|hqdefault|sddefault|maxresdefault)")
+
+# 썸네일 CDN(i.ytimg.com) 요청용 공유 세션 (keep-alive로 TLS 핸드셰이크 재사용)
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
 
 
 # ======================== 유틸 함수 ==========================
@@ -39,6 +69,16 @@ def setup_driver():
     )
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
+
+    # 썸네일 URL은 style 문자열에서 읽으므로 브라우저가 이미지를 받을 필요 없음
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option(
+        "prefs", {"profile.managed_default_content_settings.images": 2}
+    )
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disk-cache-size=0")
+    if HEADLESS:
+        options.add_argument("--headless=new")
     return webdriver.Chrome(options=options)
 
 
@@ -98,25 +138,24 @@ def get_period_list_utc(year, month):
 def scroll_to_bottom_until_fully_loaded(
     driver, selector="div.thumb.lazy-image", max_wait=30
 ):
-    last_count = 0
-    same_count_retry = 0
+    # 매번 썸네일 요소 전체를 세는 대신, 문서 높이가 더 이상 늘지 않을 때까지 스크롤
+    get_height = "return document.documentElement.scrollHeight"
+    same_height_retry = 0
     for _ in range(max_wait):
-        driver.execute_script(
-            "window.scrollTo(0, document.documentElement.scrollHeight);"
-        )
+        prev_height = driver.execute_script(get_height)
+        driver.execute_script("window.scrollTo(0, arguments[0]);", prev_height)
         try:
             WebDriverWait(driver, 5).until(
-                lambda d: len(d.find_elements(By.CSS_SELECTOR, selector)) > last_count
+                lambda d: d.execute_script(get_height) > prev_height
             )
         except:
-            same_count_retry += 1
-            if same_count_retry >= 3:
+            same_height_retry += 1
+            if same_height_retry >= 3:
                 break
         else:
-            same_count_retry = 0
-            last_count = len(driver.find_elements(By.CSS_SELECTOR, selector))
-        print(f"🔽 현재 로드된 썸네일 div 수: {last_count}")
-    print("✅ 스크롤 완료")
+            same_height_retry = 0
+    count = len(driver.find_elements(By.CSS_SELECTOR, selector))
+    print(f"✅ 스크롤 완료 (로드된 썸네일 div 수: {count})")
 
 
 def extract_playboard_thumbnails(driver):
@@ -124,7 +163,7 @@ def extract_playboard_thumbnails(driver):
     elements = driver.find_elements(By.CSS_SELECTOR, "div.thumb.lazy-image")
     for el in elements:
         style = el.get_attribute("style")
-        match = re.search(r"url\(['\"]?(.*?)['\"]?\)", style or "")
+        match = _URL_BG_RE.search(style or "")
         url = match.group(1) if match else el.get_attribute("data-background-image")
         if url and url.startswith("//"):
             url = "https:" + url
@@ -134,14 +173,83 @@ def extract_playboard_thumbnails(driver):
     return thumbnails
 
 
+def session_from_driver(driver):
+    """로그인된 Selenium 드라이버의 쿠키/User-Agent로 requests 세션을 만듭니다."""
+    session = requests.Session()
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent")
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie.get("domain"),
+            path=cookie.get("path", "/"),
+        )
+    return session
+
+
+def _collect_thumbnail_urls(obj, thumbnails, seen_urls):
+    # 응답 스키마에 의존하지 않도록 JSON 전체에서 유튜브 썸네일 URL을 수집
+    if isinstance(obj, dict):
+        for value in obj.values():
+            _collect_thumbnail_urls(value, thumbnails, seen_urls)
+    elif isinstance(obj, list):
+        for value in obj:
+            _collect_thumbnail_urls(value, thumbnails, seen_urls)
+    elif isinstance(obj, str) and _VID_ID_RE.search(obj) and "ytimg.com" in obj:
+        url = "https:" + obj if obj.startswith("//") else obj
+        if url not in seen_urls:
+            seen_urls.add(url)
+            thumbnails.append(url)
+
+
+def fetch_thumbnails_via_api(api_session, timestamp):
+    """
+    PLAYBOARD_API_URL이 설정되어 있으면 차트 JSON을 직접 요청해 썸네일 URL을 반환합니다.
+    URL에 "{page}"가 있으면 새 썸네일이 나오지 않는 페이지까지 이어서 요청합니다.
+    사용할 수 없거나 결과가 잘린 것으로 보이면 None을 반환하여 Selenium 방식으로 대체합니다.
+    """
+    if not PLAYBOARD_API_URL or api_session is None:
+        return None
+    paginated = "{page}" in PLAYBOARD_API_URL
+    thumbnails, seen_urls = [], set()
+    for page in range(1, API_MAX_PAGES + 1 if paginated else 2):
+        try:
+            res = api_session.get(
+                PLAYBOARD_API_URL.format(period=timestamp, page=page), timeout=10
+            )
+            res.raise_for_status()
+            data = res.json()
+        except Exception as e:
+            print(f"⚠️ API 요청 실패 (page {page}) → Selenium으로 대체: {e}")
+            return None
+        before = len(thumbnails)
+        _collect_thumbnail_urls(data, thumbnails, seen_urls)
+        if len(thumbnails) == before:  # 빈 페이지 → 차트 끝
+            break
+    else:
+        if paginated:
+            print(f"⚠️ API 페이지가 {API_MAX_PAGES}개를 넘음 → 이후 페이지는 생략")
+
+    if not thumbnails:
+        return None
+    if not paginated and len(thumbnails) < API_FULL_CHART_SIZE:
+        print(
+            f"⚠️ API 결과가 {len(thumbnails)}개로 전체 차트({API_FULL_CHART_SIZE}개)보다 적음 "
+            "→ 잘린 응답으로 보고 Selenium으로 대체"
+        )
+        return None
+    return thumbnails
+
+
 def try_higher_quality(url, HD=False):
     if HD:
         quality = "maxresdefault"
-        high_url = re.sub(
-            r"(default|mqdefault|hqdefault|sddefault|maxresdefault)", quality, url
-        )
+        high_url = _QUAL_RE.sub(quality, url)
         try:
-            if requests.get(high_url, timeout=5).status_code == 200:
+            if (
+                SESSION.head(high_url, timeout=5, allow_redirects=True).status_code
+                == 200
+            ):
                 return high_url, quality
             else:
                 return None, None
@@ -150,29 +258,43 @@ def try_higher_quality(url, HD=False):
     else:
         qualities = ["maxresdefault", "sddefault", "hqdefault", "mqdefault"]
         for quality in qualities:
-            high_url = re.sub(
-                r"(default|mqdefault|hqdefault|sddefault|maxresdefault)", quality, url
-            )
+            high_url = _QUAL_RE.sub(quality, url)
             try:
-                if requests.get(high_url, timeout=5).status_code == 200:
+                if (
+                    SESSION.head(high_url, timeout=5, allow_redirects=True).status_code
+                    == 200
+                ):
                     return high_url, quality
             except:
                 continue
         return url, "unknown"
 
 
+def download_file(url, filepath):
+    with SESSION.get(url, stream=True, timeout=10) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        with open(filepath, "wb") as f:
+            # 썸네일(20~200KiB)이 1~2번의 read로 끝나도록 128KiB 버퍼 사용
+            shutil.copyfileobj(r.raw, f, length=1 << 17)
+            # Linux: 곧 다시 읽지 않으므로 페이지 캐시를 비워도 된다는 힌트
+            if hasattr(os, "posix_fadvise"):
+                f.flush()
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
 def download_images(image_urls, save_path, HD=False, label=None):
     base_folder = os.path.dirname(os.path.dirname(save_path))
     saved_ids_file = os.path.join(base_folder, "saved_urls.txt")
 
     saved_ids = set()
-    existing_lines = []
     if os.path.exists(saved_ids_file):
         with open(saved_ids_file, "r") as f:
             for line in f:
-                existing_lines.append(line.strip())
+                if not line.strip():
+                    continue
                 url = line.strip().split()[-1]
-                match = re.search(r"/vi/([a-zA-Z0-9_-]+)/", url)
+                match = _VID_ID_RE.search(url)
                 if match:
                     saved_ids.add(match.group(1))
 
@@ -183,38 +305,58 @@ def download_images(image_urls, save_path, HD=False, label=None):
         for q in ["maxresdefault", "sddefault", "hqdefault", "mqdefault", "unknown"]
     }
 
+    # 0) 이미 저장된 ID는 네트워크 요청 전에 제외 (화질만 바뀌므로 원본 URL의 ID와 동일)
+    candidates = []
     for url in image_urls:
-        high_url, quality = try_higher_quality(url, HD=HD)
-        if not high_url:
-            print(f"⏭️ 고화질 없음 → 스킵: {url}")
-            continue
-
-        match = re.search(r"/vi/([a-zA-Z0-9_-]+)/", high_url)
+        match = _VID_ID_RE.search(url)
         video_id = match.group(1) if match else None
         if video_id in saved_ids:
             print(f"⚠️ 중복 ID: {video_id} → 스킵")
             continue
-
-        filename = (
-            f"{label}_{downloaded+1:03d}_{video_id}.jpg"
-            if video_id
-            else f"{label}_{downloaded+1:03d}.jpg"
+        if video_id:
+            saved_ids.add(video_id)  # 같은 실행 내 중복 다운로드 방지
+        candidates.append((url, video_id))
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+        # 1) 고화질 URL 확인 (병렬, 입력 순서 유지)
+        probes = list(
+            ex.map(lambda candidate: try_higher_quality(candidate[0], HD=HD), candidates)
         )
-        filepath = os.path.join(save_path, filename)
-        try:
-            urlretrieve(high_url, filepath)
-            print(f"✔ 저장됨: {filepath}")
-            downloaded += 1
-            saved_ids.add(video_id)
-            new_lines.append(f"{label or 'unknown'} {high_url}")
-            if not HD:
-                quality_counter[quality] += 1
-        except Exception as e:
-            print(f"❌ 실패: {high_url} - {e}")
 
-    with open(saved_ids_file, "w") as f:
-        for line in existing_lines + new_lines:
-            f.write(line + "\n")
+        # 2) 파일명 지정 (메인 스레드에서 순서대로)
+        tasks = []
+        for (url, video_id), (high_url, quality) in zip(candidates, probes):
+            if not high_url:
+                print(f"⏭️ 고화질 없음 → 스킵: {url}")
+                continue
+
+            seq = len(tasks) + 1
+            filename = (
+                f"{label}_{seq:03d}_{video_id}.jpg"
+                if video_id
+                else f"{label}_{seq:03d}.jpg"
+            )
+            tasks.append((high_url, quality, os.path.join(save_path, filename)))
+
+        # 3) 다운로드 (병렬)
+        futures = [
+            ex.submit(download_file, high_url, filepath)
+            for high_url, _, filepath in tasks
+        ]
+        for future, (high_url, quality, filepath) in zip(futures, tasks):
+            try:
+                future.result()
+                print(f"✔ 저장됨: {filepath}")
+                downloaded += 1
+                new_lines.append(f"{label or 'unknown'} {high_url}")
+                if not HD:
+                    quality_counter[quality] += 1
+            except Exception as e:
+                print(f"❌ 실패: {high_url} - {e}")
+
+    # 새로 저장한 항목만 이어 쓰기 (기존 내용 전체 재작성 방지)
+    with open(saved_ids_file, "a") as f:
+        f.writelines(line + "\n" for line in new_lines)
 
     print(f"\n📦 저장 완료: {downloaded}장")
     if not HD:
@@ -259,6 +401,7 @@ def main(hd_mode=True, use_period_mode=True):
     )
     driver = setup_driver()
     login_playboard(driver, PLAYBOARD_EMAIL, PLAYBOARD_PASSWORD)
+    api_session = session_from_driver(driver) if PLAYBOARD_API_URL else None
 
     total_quality_counter = {
         q: 0
@@ -271,12 +414,17 @@ def main(hd_mode=True, use_period_mode=True):
             print(f"\n=== 🔍 날짜: {label} ===")
             date_folder = os.path.join(base_path, label)
             os.makedirs(date_folder, exist_ok=True)
-            period_url = f"https://playboard.co/chart/video/most-viewed-all-videos-in-south-korea-daily?period={timestamp}"
-            if not safe_page_load(driver, period_url):
-                continue
+
+            # ⚡ JSON API로 가져올 수 있으면 브라우저 렌더링/스크롤 생략
+            thumbnails = fetch_thumbnails_via_api(api_session, timestamp)
+            if thumbnails is None:
+                period_url = f"https://playboard.co/chart/video/most-viewed-all-videos-in-south-korea-daily?period={timestamp}"
+                if not safe_page_load(driver, period_url):
+                    continue
             try:
-                scroll_to_bottom_until_fully_loaded(driver)
-                thumbnails = extract_playboard_thumbnails(driver)
+                if thumbnails is None:
+                    scroll_to_bottom_until_fully_loaded(driver)
+                    thumbnails = extract_playboard_thumbnails(driver)
                 print(f"🎯 {label} 썸네일 수: {len(thumbnails)}")
                 download_images(thumbnails, date_folder, HD=hd_mode, label=label)
             except Exception as e:
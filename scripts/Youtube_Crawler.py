@@ -1,23 +1,94 @@
 # crawler.py
 
-import time
+import atexit
+import csv
 import os
 import re
+import shutil
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import pandas as pd
+from logging.handlers import QueueHandler, QueueListener
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from dotenv import load_dotenv
 
+load_dotenv()
 
-def is_duplicate_image(video_id, save_dir):
-    for filename in os.listdir(save_dir):
-        if filename.endswith(".jpg") and video_id in filename:
-            return True
-    return False
+
+DOWNLOAD_WORKERS = 32  # 썸네일 동시 다운로드 수 (= 세션 커넥션 풀 크기)
+BUCKET_THUMBNAILS = False  # True: video_id 앞 두 글자 하위 폴더에 나눠 저장 (누적 보관용)
+USE_INNERTUBE = True  # True: Innertube JSON API 우선, 실패 시 Selenium 스크롤 방식
+
+YOUTUBE_TRENDING_URL = "https://www.youtube.com/feed/trending?bp=6gQJRkVleHBsb3Jl"
+TRENDING_BROWSE_PARAMS = "6gQJRkVleHBsb3Jl"  # 위 URL의 bp 값
+INNERTUBE_BROWSE_URL = "https://www.youtube.com/youtubei/v1/browse"
+INNERTUBE_CLIENT_VERSION = "2.20240101.00.00"
+INNERTUBE_API_KEY = os.getenv("INNERTUBE_API_KEY")  # (선택) 없으면 키 없이 요청
+
+# 다운로드 스레드는 큐에 메시지만 넣고, 실제 stdout 출력은 별도 리스너 스레드가 담당
+logger = logging.getLogger("crawler")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# i.ytimg.com 연결(keep-alive)을 모든 HEAD/GET 요청과 스레드가 공유
+_SESSION = requests.Session()
+_SESSION.headers["User-Agent"] = "Mozilla/5.0"
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=DOWNLOAD_WORKERS,
+        max_retries=Retry(total=2, backoff_factor=0.3),
+    ),
+)
+
+
+# 파일명 정리용 패턴 (파일 시스템 금지 문자 /*?:"<>| 등도 허용 목록 밖이라 함께 제거됨)
+_NON_ALLOWED_RE = re.compile(r"[^a-zA-Z0-9가-힣\s\._-]")
+
+# 저장 파일명 "{날짜}_{순위}_{video_id}.jpg"에서 video_id(11자) 추출
+_VIDEO_ID_RE = re.compile(r"_([A-Za-z0-9_-]{11})\.jpg$")
+
+
+def _scan_video_ids(save_dir, ids, descend):
+    with os.scandir(save_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".jpg"):
+                m = _VIDEO_ID_RE.search(entry.name)
+                if m:
+                    ids.add(m.group(1))
+            elif descend and len(entry.name) == 2 and entry.is_dir():
+                _scan_video_ids(entry.path, ids, descend=False)
+
+
+def existing_video_ids(save_dir):
+    """
+    폴더에 이미 저장된 썸네일의 video_id 집합을 한 번에 만들어 반환합니다.
+    video_id 앞 두 글자로 나눈 하위 폴더(버킷)도 한 단계까지 함께 확인합니다.
+    """
+    ids = set()
+    _scan_video_ids(save_dir, ids, descend=True)
+    return ids
 
 
 def sanitize_filename(filename):
@@ -25,65 +96,179 @@ def sanitize_filename(filename):
     파일 이름으로 사용할 수 없는 문자 및 인코딩 문제를 일으킬 수 있는
     이모지, 특수 기호 등을 완벽하게 제거합니다.
     """
-    # 1. 기본적으로 허용되지 않는 파일 시스템 문자 제거
-    sanitized = re.sub(r'[\\/*?:"<>|]', "", filename)
-    # 2. 이모지를 포함한 대부분의 특수 기호를 제거 (한글, 영문, 숫자, 공백, 점, 밑줄, 하이픈만 허용)
-    sanitized = re.sub(r"[^a-zA-Z0-9가-힣\s\._-]", "", sanitized).strip()
-    # 3. 공백이 연속으로 오는 경우 하나로 합침
-    sanitized = re.sub(r"\s+", " ", sanitized)
-    return sanitized
-
-
-def get_high_quality_thumbnail_url(video_id):
-    """가능한 최고 화질의 썸네일 URL을 반환합니다."""
-    urls_to_try = [
-        f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
-        f"https://i.ytimg.com/vi/{video_id}/hq720.jpg",
-        f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
-    ]
-    for url in urls_to_try:
-        try:
-            response = requests.head(url, timeout=5)
-            if response.status_code == 200:
-                return url
-        except requests.RequestException:
-            continue
-    return urls_to_try[-1]
+    # 파일 시스템 금지 문자와 이모지 등 특수 기호를 한 번에 제거하고
+    # (한글, 영문, 숫자, 공백, 점, 밑줄, 하이픈만 허용)
+    # split/join으로 앞뒤 공백 제거와 연속 공백 합치기를 함께 처리
+    return " ".join(_NON_ALLOWED_RE.sub("", filename).split())
+
+
+# 시도할 썸네일 화질 (높은 화질부터)
+_THUMBNAIL_QUALITIES = ("maxresdefault", "hq720", "hqdefault")
+
+# video_id -> (실제로 받아진 하위 화질의 인덱스, 기록 시각) LRU 캐시
+# 재요청 시 404 단계를 건너뛰되, maxresdefault는 나중에 생성될 수 있으므로 TTL 후 다시 시도
+_resolved_quality = OrderedDict()
+_resolved_quality_lock = threading.Lock()
+_RESOLVED_QUALITY_MAX = 4096
+_RESOLVED_QUALITY_TTL = 3600  # 초
+
+
+def _cached_quality(video_id):
+    with _resolved_quality_lock:
+        entry = _resolved_quality.get(video_id)
+        if entry is None:
+            return 0
+        idx, saved_at = entry
+        if time.monotonic() - saved_at > _RESOLVED_QUALITY_TTL:
+            del _resolved_quality[video_id]
+            return 0
+        _resolved_quality.move_to_end(video_id)
+        return idx
+
 
+def _remember_quality(video_id, idx):
+    with _resolved_quality_lock:
+        if idx == 0:  # 최고 화질이면 건너뛸 단계가 없으므로 기록하지 않음
+            _resolved_quality.pop(video_id, None)
+            return
+        _resolved_quality[video_id] = (idx, time.monotonic())
+        _resolved_quality.move_to_end(video_id)
+        while len(_resolved_quality) > _RESOLVED_QUALITY_MAX:
+            _resolved_quality.popitem(last=False)
 
-def download_and_verify_image(url, path, title):
-    """URL에서 이미지를 다운로드하고 성공 여부를 검증합니다."""
+_JPEG_MAGIC = b"\xff\xd8\xff"  # JPEG SOI 마커 + 다음 마커 시작
+
+
+def save_thumbnail(video_id, path, session=_SESSION):
+    """
+    가능한 최고 화질의 썸네일을 바로 GET으로 받아 path에 스트리밍 저장하고
+    (url, 저장된 바이트 수)를 반환합니다. JPEG가 아닌 응답이면 저장하지 않고 0을 반환합니다.
+    maxresdefault가 없을 때(404)만 다음 화질로 내려갑니다.
+    """
+    last = len(_THUMBNAIL_QUALITIES) - 1
+    for idx in range(_cached_quality(video_id), last + 1):
+        url = f"https://i.ytimg.com/vi/{video_id}/{_THUMBNAIL_QUALITIES[idx]}.jpg"
+        with session.get(url, timeout=10, stream=True) as r:
+            if r.status_code == 404 and idx < last:
+                r.content  # 짧은 404 본문을 비워 커넥션을 풀에 돌려줌
+                continue
+            r.raise_for_status()
+            r.raw.decode_content = True
+            # 첫 바이트로 JPEG 여부를 먼저 확인해 깨진 응답은 파일로 만들지 않음
+            head = r.raw.read(len(_JPEG_MAGIC))
+            if head != _JPEG_MAGIC:
+                nbytes = 0
+            else:
+                with open(path, "wb") as handler:
+                    handler.write(head)
+                    shutil.copyfileobj(r.raw, handler, length=64 * 1024)
+                    nbytes = handler.tell()
+        if nbytes > 0:  # 정상 JPEG를 받은 경우에만 화질 기록
+            _remember_quality(video_id, idx)
+        return url, nbytes
+
+
+def download_and_verify_image(video_id, path, title, session=_SESSION):
+    """썸네일을 다운로드해 저장하고 성공 여부를 검증합니다."""
     try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        img_data = requests.get(url, headers=headers, timeout=10).content
-        with open(path, "wb") as handler:
-            handler.write(img_data)
+        thumbnail_url, nbytes = save_thumbnail(video_id, path, session)
+        logger.info(f"  고화질 썸네일 URL 확보: {thumbnail_url}")
 
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            print(f"  [성공] 썸네일 저장 완료: {os.path.basename(path)}")
+        if nbytes > 0:
+            logger.info(f"  [성공] 썸네일 저장 완료: {os.path.basename(path)}")
             return True
         else:
-            print(f"  [실패] 썸네일 파일 생성 실패 또는 크기 0: {title}")
+            logger.warning(f"  [실패] 썸네일 응답이 비었거나 JPEG가 아님: {title}")
             return False
     except Exception as e:
-        print(f"  [오류] 썸네일 다운로드 중 오류 발생: {e}")
+        logger.error(f"  [오류] 썸네일 다운로드 중 오류 발생: {e}")
         return False
 
 
-def crawl_youtube_trending():
+def download_thumbnail(record, image_folder, session=_SESSION):
     """
-    유튜브 인기 급상승 동영상의 썸네일과 정보를 크롤링합니다.
-    성공 시 썸네일이 저장된 폴더 경로를 반환합니다.
+    (스레드 풀 작업) 하나의 동영상에 대해 고화질 썸네일을 다운로드합니다.
+    성공 시 CSV에 기록할 메타데이터를, 실패 시 None을 반환합니다.
     """
-    youtube_trending_url = "https://www.youtube.com/feed/trending?bp=6gQJRkVleHBsb3Jl"
+    rank, title, link, video_id = (
+        record["rank"],
+        record["title"],
+        record["link"],
+        record["video_id"],
+    )
+    image_filename = f"{record['date_str']}_{rank:03d}_{video_id}.jpg"
+    if BUCKET_THUMBNAILS:
+        # 한 폴더에 파일이 몰리지 않도록 video_id 앞 두 글자 하위 폴더에 저장
+        os.makedirs(os.path.join(image_folder, video_id[:2]), exist_ok=True)
+        image_filename = os.path.join(video_id[:2], image_filename)
+    image_path = os.path.join(image_folder, image_filename)
+
+    logger.info(f"\n[{rank}] 처리 중: {title}")
+
+    if download_and_verify_image(video_id, image_path, title, session):
+        return {
+            "rank": rank,
+            "title": title,
+            "link": link,
+            "thumbnail_file": image_filename,
+        }
+    return None
 
-    now = datetime.now()
-    timestamp_str = now.strftime("%Y-%m-%d_%H-%M-%S")
-    base_folder = os.path.dirname(os.path.dirname(__file__))
-    image_folder = os.path.join("data", "Youtube_Trending", f"{timestamp_str}")
-    os.makedirs(image_folder, exist_ok=True)
-    print(f"폴더 생성: {image_folder}")
 
+def _collect_video_renderers(obj, videos):
+    # 응답 구조(탭/섹션/셸프)가 바뀌어도 되도록 JSON 전체에서 videoRenderer를 순서대로 수집
+    if isinstance(obj, dict):
+        renderer = obj.get("videoRenderer")
+        if isinstance(renderer, dict) and renderer.get("videoId"):
+            title = renderer.get("title", {})
+            runs = title.get("runs") or [{}]
+            videos.append(
+                {
+                    "title": runs[0].get("text") or title.get("simpleText", ""),
+                    "href": f"https://www.youtube.com/watch?v={renderer['videoId']}",
+                }
+            )
+            return
+        for value in obj.values():
+            _collect_video_renderers(value, videos)
+    elif isinstance(obj, list):
+        for value in obj:
+            _collect_video_renderers(value, videos)
+
+
+def fetch_trending_via_innertube(session=_SESSION):
+    """
+    Innertube browse API로 인기 급상승 목록을 JSON으로 받아 [{title, href}, ...]를 반환합니다.
+    사용할 수 없으면 None을 반환하여 Selenium 방식으로 대체합니다.
+    """
+    body = {
+        "context": {
+            "client": {
+                "clientName": "WEB",
+                "clientVersion": INNERTUBE_CLIENT_VERSION,
+                "hl": "ko",
+                "gl": "KR",
+            }
+        },
+        "browseId": "FEtrending",
+        "params": TRENDING_BROWSE_PARAMS,
+    }
+    params = {"prettyPrint": "false"}
+    if INNERTUBE_API_KEY:
+        params["key"] = INNERTUBE_API_KEY
+    try:
+        res = session.post(INNERTUBE_BROWSE_URL, params=params, json=body, timeout=10)
+        res.raise_for_status()
+        data = res.json()
+    except Exception as e:
+        logger.warning(f"⚠️ Innertube 요청 실패 → Selenium으로 대체: {e}")
+        return None
+    videos = []
+    _collect_video_renderers(data, videos)
+    return videos or None
+
+
+def setup_driver():
     options = Options()
     options.add_argument("--headless=new")
     options.add_argument("--no-sandbox")
@@ -93,98 +278,185 @@ def crawl_youtube_trending():
     )
     options.add_argument("--window-size=1920,1080")
     options.add_argument("--lang=ko_KR")
+    # onload(모든 하위 리소스)까지 기다리지 않고 DOMContentLoaded 시점에 driver.get 반환
+    # (이후 ytd-video-renderer 대기로 준비 여부를 확인)
+    options.page_load_strategy = "eager"
     options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    # 썸네일은 i.ytimg.com에서 직접 받으므로 페이지 내 이미지/알림은 차단
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option(
+        "prefs",
+        {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        },
+    )
+    return webdriver.Chrome(options=options)
 
-    driver = webdriver.Chrome(options=options)
-    print("WebDriver 시작됨")
 
+# 반복 크롤링 시 Chrome 기동/종료 비용을 피하기 위해 드라이버를 모듈 단위로 재사용
+_driver = None
+
+
+def _get_driver():
+    global _driver
+    if _driver is None:
+        _driver = setup_driver()
+        logger.info("WebDriver 시작됨")
+    return _driver
+
+
+def _quit_driver():
+    global _driver
+    if _driver is not None:
+        try:
+            _driver.quit()
+        finally:
+            _driver = None
+            logger.info("WebDriver 종료됨")
+
+
+atexit.register(_quit_driver)
+
+
+def fetch_trending_via_selenium():
+    """헤드리스 Chrome으로 인기 급상승 페이지를 끝까지 스크롤해 [{title, href}, ...]를 반환합니다."""
+    driver = _get_driver()
     try:
-        driver.get(youtube_trending_url)
+        driver.get(YOUTUBE_TRENDING_URL)
         WebDriverWait(driver, 20).until(
             EC.presence_of_element_located((By.CSS_SELECTOR, "ytd-video-renderer"))
         )
 
-        last_height = driver.execute_script(
-            "return document.documentElement.scrollHeight"
-        )
+        # 고정 2초 대기 대신, 문서 높이가 늘어나는 즉시 다음 스크롤로 진행
+        get_height = "return document.documentElement.scrollHeight"
         while True:
+            last_height = driver.execute_script(get_height)
             driver.execute_script(
                 "window.scrollTo(0, document.documentElement.scrollHeight);"
             )
-            time.sleep(2)
-            new_height = driver.execute_script(
-                "return document.documentElement.scrollHeight"
-            )
-            if new_height == last_height:
+            try:
+                WebDriverWait(driver, 4).until(
+                    lambda d: d.execute_script(get_height) > last_height
+                )
+            except TimeoutException:
                 break
-            last_height = new_height
 
-        all_video_elements = driver.find_elements(By.CSS_SELECTOR, "ytd-video-renderer")
-        print(f"\n총 {len(all_video_elements)}개의 동영상 발견. 데이터 추출 시작...")
+        # 동영상별 find_element/get_attribute 왕복 대신 한 번의 스크립트로 일괄 추출
+        # (링크가 없는 항목도 null로 남겨 순위(인덱스)를 그대로 유지)
+        return driver.execute_script(
+            """
+            return Array.from(document.querySelectorAll('ytd-video-renderer')).map(r => {
+                const a = r.querySelector('a#video-title');
+                return a ? {title: a.title, href: a.href} : null;
+            });
+            """
+        )
+    finally:
+        # 다음 호출을 위해 상태만 초기화 (세션이 깨졌으면 버리고 다음에 새로 생성)
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except WebDriverException:
+            _quit_driver()
 
-        video_data = []
-        for i, video_element in enumerate(all_video_elements):
+
+def crawl_youtube_trending():
+    """
+    유튜브 인기 급상승 동영상의 썸네일과 정보를 크롤링합니다.
+    성공 시 썸네일이 저장된 폴더 경로를 반환합니다.
+    """
+    now = datetime.now()
+    timestamp_str = now.strftime("%Y-%m-%d_%H-%M-%S")
+    base_folder = os.path.dirname(os.path.dirname(__file__))
+    image_folder = os.path.join("data", "Youtube_Trending", f"{timestamp_str}")
+    os.makedirs(image_folder, exist_ok=True)
+    logger.info(f"폴더 생성: {image_folder}")
+
+    try:
+        all_videos = fetch_trending_via_innertube() if USE_INNERTUBE else None
+        if all_videos is None:
+            all_videos = fetch_trending_via_selenium()
+        logger.info(f"\n총 {len(all_videos)}개의 동영상 발견. 데이터 추출 시작...")
+
+        # 1) 추출한 메타데이터로 다운로드 작업 목록 구성
+        existing_ids = existing_video_ids(image_folder)
+        today_str = now.strftime("%Y.%m.%d")
+        records = []
+        for i, video in enumerate(all_videos):
             try:
-                title_element = video_element.find_element(
-                    By.CSS_SELECTOR, "a#video-title"
-                )
-                title = title_element.get_attribute("title")
-                link = title_element.get_attribute("href")
+                if not video:
+                    continue
+                title = video["title"]
+                link = video["href"]
 
                 if not link or "watch?v=" not in link:
                     continue
 
                 video_id = link.split("watch?v=")[1].split("&")[0]
-                print(f"\n[{i + 1}/{len(all_video_elements)}] 처리 중: {title}")
 
-                if is_duplicate_image(video_id, image_folder):
-                    print(f"  ⚠️ 중복된 영상 ID → 다운로드 생략: {video_id}")
+                if video_id in existing_ids:
+                    logger.warning(f"  ⚠️ 중복된 영상 ID → 다운로드 생략: {video_id}")
                     continue
+                existing_ids.add(video_id)
 
-                thumbnail_url = get_high_quality_thumbnail_url(video_id)
-                print(f"  고화질 썸네일 URL 확보: {thumbnail_url}")
-
-                today_str = datetime.now().strftime("%Y.%m.%d")
-                image_filename = f"{today_str}_{i + 1:03d}_{video_id}.jpg"
-                image_path = os.path.join(image_folder, image_filename)
-
-                if download_and_verify_image(thumbnail_url, image_path, title):
-                    video_data.append(
-                        {
-                            "rank": i + 1,
-                            "title": title,
-                            "link": link,
-                            "thumbnail_file": image_filename,
-                        }
-                    )
+                records.append(
+                    {
+                        "rank": i + 1,
+                        "title": title,
+                        "link": link,
+                        "video_id": video_id,
+                        "date_str": today_str,
+                    }
+                )
             except Exception as e:
-                print(f"  - 동영상 정보 처리 중 예상치 못한 오류: {e}")
+                logger.error(f"  - 동영상 정보 처리 중 예상치 못한 오류: {e}")
                 continue
 
+        # 2) 썸네일 다운로드는 스레드 풀에서 병렬로 수행
+        video_data = []
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(DOWNLOAD_WORKERS, len(records)))
+        ) as ex:
+            futures = [
+                ex.submit(download_thumbnail, record, image_folder, _SESSION)
+                for record in records
+            ]
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"  - 동영상 정보 처리 중 예상치 못한 오류: {e}")
+                    continue
+                if result:
+                    video_data.append(result)
+        video_data.sort(key=lambda row: row["rank"])
+
         if video_data:
-            df = pd.DataFrame(video_data)
             csv_path = os.path.join(
                 base_folder, f"youtube_trending_rankings_{timestamp_str}.csv"
             )
-            df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-            print(f"\n데이터 저장 완료: {csv_path} ({len(video_data)}개 수집)")
+            with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.DictWriter(
+                    f, fieldnames=["rank", "title", "link", "thumbnail_file"]
+                )
+                writer.writeheader()
+                writer.writerows(video_data)
+            logger.info(f"\n데이터 저장 완료: {csv_path} ({len(video_data)}개 수집)")
             return image_folder
         else:
-            print("\n수집된 유효한 데이터가 없습니다.")
+            logger.info("\n수집된 유효한 데이터가 없습니다.")
             return None
 
     except Exception as e:
-        print(f"크롤링 중 심각한 오류 발생: {e}")
+        logger.error(f"크롤링 중 심각한 오류 발생: {e}")
         return None
-    finally:
-        driver.quit()
-        print("WebDriver 종료됨")
 
 
 if __name__ == "__main__":
-    print("--- 크롤러 모듈 단독 테스트 실행 ---")
+    logger.info("--- 크롤러 모듈 단독 테스트 실행 ---")
     result_folder = crawl_youtube_trending()
     if result_folder:
-        print(f"\n[테스트 성공] 썸네일이 저장된 최종 경로: {result_folder}")
+        logger.info(f"\n[테스트 성공] 썸네일이 저장된 최종 경로: {result_folder}")
     else:
-        print("\n[테스트 실패] 크롤링에 실패했거나 수집된 데이터가 없습니다.")
+        logger.info("\n[테스트 실패] 크롤링에 실패했거나 수집된 데이터가 없습니다.")